@@ -0,0 +1,192 @@
+# crewai_backend/core.py
+from bisect import bisect_left, insort
+from collections import deque
+from functools import lru_cache
+from itertools import groupby, islice
+from operator import itemgetter
+from typing import List, Dict, Optional, Tuple
+
+import numpy as np
+from pydantic import BaseModel, Field, TypeAdapter, field_validator
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+# A partir de este tamaño el empaquetado trabaja sobre arrays de NumPy
+NUMPY_MIN_DELIVERIES = 64
+
+if NUMBA_AVAILABLE:
+    @njit(cache=True, nogil=True)
+    def _best_fit_kernel(weights, order, capacities):
+        """Best-Fit compilado: índice de vehículo por entrega o -1."""
+        remaining = capacities.copy()
+        assignment = np.full(weights.size, -1, np.int64)
+        p = 0
+        while p < order.size:
+            weight = weights[order[p]]
+            best = -1
+            for v in range(remaining.size):
+                if remaining[v] >= weight and (best < 0 or remaining[v] < remaining[best]):
+                    best = v
+            # Las copias del mismo peso van al mismo vehículo mientras quepan
+            # (sigue siendo el mejor hueco); si no cabe ninguna, se salta el grupo
+            while p < order.size and weights[order[p]] == weight:
+                if best >= 0:
+                    if remaining[best] < weight:
+                        break
+                    remaining[best] -= weight
+                    assignment[order[p]] = best
+                p += 1
+        return assignment
+
+    # Compilar al importar para que la primera petición no pague el JIT.
+    # Las capacidades llegan de _fleet_profile como array de solo lectura.
+    _warmup_capacities = np.ones(1)
+    _warmup_capacities.setflags(write=False)
+    _best_fit_kernel(np.ones(1), np.zeros(1, np.int64), _warmup_capacities)
+
+@lru_cache(maxsize=128)
+def _fleet_profile(capacities: Tuple[float, ...]) -> Tuple[float, Tuple[Tuple[float, int], ...], np.ndarray]:
+    """
+    Datos derivados de la flota que no dependen de las entregas: capacidad
+    máxima, huecos (capacidad, índice) ordenados y array para el kernel.
+    Se cachean porque un mismo cliente suele repetir la misma flota.
+    """
+    capacities_array = np.array(capacities, dtype=np.float64)
+    capacities_array.setflags(write=False)
+    slots = tuple(sorted((capacity, index) for index, capacity in enumerate(capacities)))
+    return max(capacities), slots, capacities_array
+
+def _best_fit_decreasing(weights: List[float], capacities: List[float]) -> List[int]:
+    """
+    Asigna cada entrega, de mayor a menor peso, al vehículo con menor
+    capacidad restante donde cabe. Devuelve el índice de vehículo por
+    entrega, o -1 si no cabe en ninguno.
+    """
+    max_capacity, fleet_slots, capacities_array = _fleet_profile(tuple(capacities))
+
+    # Las entregas más pesadas que el mayor vehículo nunca se consideran
+    oversized = sum(1 for weight in weights if weight > max_capacity)
+
+    # Orden decreciente estable: a igual peso se respeta el orden de entrada.
+    # Las entregas sobredimensionadas quedan al principio y se saltan.
+    if len(weights) < NUMPY_MIN_DELIVERIES:
+        order = islice(sorted(range(len(weights)), key=weights.__getitem__, reverse=True), oversized, None)
+    else:
+        weights_array = np.fromiter(weights, dtype=np.float64, count=len(weights))
+        order_array = np.argsort(-weights_array, kind="stable")[oversized:]
+        if NUMBA_AVAILABLE:
+            return _best_fit_kernel(weights_array, order_array, capacities_array).tolist()
+        order = order_array.tolist()
+
+    # Capacidad restante por vehículo, ordenada ascendente para búsqueda binaria
+    slots = list(fleet_slots)
+    assignment = [-1] * len(weights)
+
+    # Entregas de igual peso son consecutivas en el orden: tras colocar una,
+    # el mismo vehículo sigue siendo el mejor hueco para la siguiente copia
+    # mientras quepa, así que solo se busca de nuevo al llenarse
+    pending = deque()
+    for weight, group in groupby(order, key=weights.__getitem__):
+        pending.extend(group)
+        while pending:
+            pos = bisect_left(slots, (weight, -1))
+            if pos == len(slots):
+                pending.clear()
+                break
+            remaining, vehicle_index = slots.pop(pos)
+            while pending and remaining >= weight:
+                assignment[pending.popleft()] = vehicle_index
+                remaining -= weight
+            insort(slots, (remaining, vehicle_index))
+
+    return assignment
+
+def route_optimization_tool(deliveries_data: List[Dict], fleet_data: List[Dict]) -> Dict:
+    """
+    Optimiza rutas de entrega basado en entregas y flota disponible.
+
+    Usa Best-Fit Decreasing: las entregas se recorren de mayor a menor peso
+    y cada una va al vehículo con menor capacidad restante donde aún cabe.
+    """
+    if not deliveries_data or not fleet_data:
+        return {
+            "optimizedRoutes": [],
+            "unassignedDeliveries": deliveries_data or []
+        }
+
+    # Peso y capacidad son obligatorios en los modelos: lectura directa en C
+    weights = list(map(itemgetter('weight'), deliveries_data))
+    capacities = list(map(itemgetter('capacity'), fleet_data))
+
+    total_weight = sum(weights)
+    if total_weight <= max(capacities):
+        # Todo cabe en un solo vehículo: se usa el más pequeño que lo admite
+        _, vehicle_index = min(
+            (capacity, index) for index, capacity in enumerate(capacities)
+            if capacity >= total_weight
+        )
+        assignment = [vehicle_index] * len(weights)
+    else:
+        assignment = _best_fit_decreasing(weights, capacities)
+
+    routes: Dict[int, Dict] = {}
+    unassigned_deliveries = []
+    for delivery, weight, vehicle_index in zip(deliveries_data, weights, assignment):
+        if vehicle_index < 0:
+            unassigned_deliveries.append(delivery)
+            continue
+        route = routes.get(vehicle_index)
+        if route is None:
+            vehicle_id = fleet_data[vehicle_index].get('id', f'vehicle_{vehicle_index}')
+            route = routes[vehicle_index] = {
+                "routeId": f"RUTA-{vehicle_id}-{vehicle_index}",
+                "vehicleId": vehicle_id,
+                "stops": [],
+                "totalWeight": 0,
+            }
+        route["stops"].append(delivery)
+        route["totalWeight"] += weight
+
+    return {
+        "optimizedRoutes": [routes[index] for index in sorted(routes)],
+        "unassignedDeliveries": unassigned_deliveries
+    }
+
+# Modelos Pydantic
+class DeliveryItem(BaseModel):
+    id: str
+    weight: float = Field(gt=0, description="Weight must be positive")
+    orderId: Optional[str] = None
+    address: Optional[str] = None
+    priority: Optional[int] = None
+
+class VehicleItem(BaseModel):
+    id: str
+    capacity: float = Field(gt=0, description="Capacity must be positive")
+    type: Optional[str] = None
+    location: Optional[str] = None
+
+class OptimizationRequest(BaseModel):
+    deliveries: List[DeliveryItem]
+    fleet: List[VehicleItem]
+
+    @field_validator('deliveries')
+    @classmethod
+    def deliveries_not_empty(cls, v):
+        if not v:
+            raise ValueError('La lista de entregas no puede estar vacía')
+        return v
+
+    @field_validator('fleet')
+    @classmethod
+    def fleet_not_empty(cls, v):
+        if not v:
+            raise ValueError('La lista de vehículos no puede estar vacía')
+        return v
+
+# Serializador compilado una sola vez para los lotes de requests
+OPTIMIZATION_BATCH = TypeAdapter(List[OptimizationRequest])
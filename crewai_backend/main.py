@@ -1,172 +1,595 @@
 # crewai_backend/main.py
-import json
+import asyncio
+import logging
 import os
-from typing import List, Dict, Optional
+import re
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing, asynccontextmanager
+from functools import lru_cache
+from hashlib import blake2b
+from importlib.util import find_spec
+from math import ceil
+from operator import itemgetter
+from typing import List, Dict, Optional, Tuple
 
+import orjson
+from cachetools import TTLCache
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field, validator
-
-try:
-    from langchain_openai import ChatOpenAI
-    from langchain_ollama import ChatOllama
-    LLM_AVAILABLE = True
-except ImportError:
-    LLM_AVAILABLE = False
-
-def route_optimization_tool(deliveries_data: List[Dict], fleet_data: List[Dict]) -> Dict:
-    """
-    Optimiza rutas de entrega basado en entregas y flota disponible.
-    """
-    if not deliveries_data or not fleet_data:
-        return {
-            "optimizedRoutes": [],
-            "unassignedDeliveries": deliveries_data or []
-        }
-
-    optimized_routes = []
-    remaining_deliveries = list(deliveries_data)
-    vehicle_index = 0
-
-    while remaining_deliveries and vehicle_index < len(fleet_data):
-        current_vehicle = fleet_data[vehicle_index]
-        new_route = {
-            "routeId": f"RUTA-{hash(str(current_vehicle))}-{vehicle_index}",
-            "vehicleId": current_vehicle.get('id', f'vehicle_{vehicle_index}'),
-            "stops": [],
-            "totalWeight": 0,
-        }
-
-        temp_remaining = []
-        for delivery in remaining_deliveries:
-            delivery_weight = delivery.get('weight', 0)
-            vehicle_capacity = current_vehicle.get('capacity', float('inf'))
-
-            if new_route["totalWeight"] + delivery_weight <= vehicle_capacity:
-                new_route["stops"].append(delivery)
-                new_route["totalWeight"] += delivery_weight
-            else:
-                temp_remaining.append(delivery)
-
-        if new_route["stops"]:
-            optimized_routes.append(new_route)
-
-        remaining_deliveries = temp_remaining
-        vehicle_index += 1
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import Response, StreamingResponse
 
-    return {
-        "optimizedRoutes": optimized_routes,
-        "unassignedDeliveries": remaining_deliveries
-    }
+from core import OPTIMIZATION_BATCH, OptimizationRequest, route_optimization_tool
 
-async def llm_optimize_routes(deliveries_data: List[Dict], fleet_data: List[Dict], llm) -> Dict:
-    """
-    Usa LLM para optimizar rutas de manera más inteligente.
-    """
-    prompt = f"""
-    Eres un experto en optimización logística. Optimiza la asignación de estas entregas a vehículos:
+logger = logging.getLogger(__name__)
 
-    ENTREGAS: {json.dumps(deliveries_data)}
-    VEHÍCULOS: {json.dumps(fleet_data)}
+# Los clientes LLM se importan en get_llm(); aquí solo se comprueba que existan
+LLM_AVAILABLE = all(find_spec(module) for module in ("langchain_openai", "langchain_ollama"))
 
+# Prompts de sistema fijos: van primero y no cambian entre peticiones, así el
+# proveedor puede reutilizar el prefijo cacheado. Los datos van en el mensaje
+# del usuario, al final.
+OPTIMIZATION_RULES = """
     REGLAS:
     1. Ningún vehículo puede exceder su capacidad
     2. Minimiza el número de vehículos usados
     3. Distribuye eficientemente las entregas
+"""
 
-    Responde SOLO con un JSON válido con esta estructura:
-    {{
+ROUTES_JSON_SCHEMA = """{
         "optimizedRoutes": [
-            {{
+            {
                 "routeId": "RUTA-X",
                 "vehicleId": "id_vehiculo",
                 "stops": [lista_de_entregas],
                 "totalWeight": peso_total
-            }}
+            }
         ],
         "unassignedDeliveries": [entregas_no_asignadas]
-    }}
+    }"""
+
+OPTIMIZATION_SYSTEM_PROMPT = f"""
+    Eres un experto en optimización logística. Optimiza la asignación de las entregas a los vehículos que te indique el usuario.
+    {OPTIMIZATION_RULES}
+    Responde SOLO con un JSON válido con esta estructura:
+    {ROUTES_JSON_SCHEMA}
+    """
+
+BATCH_OPTIMIZATION_SYSTEM_PROMPT = f"""
+    Eres un experto en optimización logística. Resuelve los problemas VRP independientes que te indique el usuario.
+    {OPTIMIZATION_RULES}
+    Responde SOLO con una lista JSON con un objeto por problema, en el mismo orden, cada uno con esta estructura:
+    {ROUTES_JSON_SCHEMA}
+    """
+
+def _log_llm_usage(response):
+    """Registra los tokens de entrada que el proveedor sirvió desde su caché."""
+    usage = getattr(response, "usage_metadata", None) or {}
+    details = usage.get("input_token_details") or {}
+    logger.debug(
+        "Tokens LLM: entrada=%s cache_read=%s cache_creation=%s",
+        usage.get("input_tokens"), details.get("cache_read"), details.get("cache_creation")
+    )
+
+# Caracteres que importan al delimitar JSON; el resto del texto se salta en C
+_JSON_DELIMITERS = re.compile(r'[{}\[\]"\\]')
+
+class _JsonScanner:
+    """
+    Localiza el primer bloque JSON balanceado que empieza por `opening`
+    ("{" o "[") en un texto que llega por fragmentos. Conserva el estado
+    (profundidad, string abierto, escape) entre fragmentos, así que cada
+    carácter se examina una sola vez aunque el texto llegue token a token.
+    """
+
+    def __init__(self, opening: str = "{"):
+        self.opening = opening
+        self.closing = "}" if opening == "{" else "]"
+        self.parts: List[str] = []
+        self.length = 0
+        self.start = -1
+        self.depth = 0
+        self.in_string = False
+        self.escaped_index = -1
+
+    def feed(self, chunk: str) -> Optional[str]:
+        """Añade un fragmento; devuelve el bloque JSON en cuanto se cierra."""
+        offset = self.length
+        self.parts.append(chunk)
+        self.length += len(chunk)
+
+        position = 0
+        if self.start < 0:
+            position = chunk.find(self.opening)
+            if position < 0:
+                return None
+            self.start = offset + position
+
+        for match in _JSON_DELIMITERS.finditer(chunk, position):
+            index = offset + match.start()
+            char = match.group()
+            if self.in_string:
+                if index == self.escaped_index:
+                    continue
+                if char == "\\":
+                    self.escaped_index = index + 1
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char == self.opening:
+                self.depth += 1
+            elif char == self.closing:
+                self.depth -= 1
+                if self.depth == 0:
+                    return "".join(self.parts)[self.start:index + 1]
+        return None
+
+def extract_json(text: str, opening: str = "{") -> str:
+    """
+    Devuelve el primer bloque JSON balanceado que empieza por `opening`
+    ("{" o "["). Recorre el texto una sola vez, sin backtracking, e ignora
+    los delimitadores dentro de strings.
+    """
+    json_text = _JsonScanner(opening).feed(text)
+    if json_text is None:
+        raise ValueError("No se encontró JSON válido en la respuesta")
+    return json_text
+
+def is_valid_routes_result(result) -> bool:
+    """Comprueba la estructura mínima que el endpoint necesita de un resultado."""
+    return (
+        isinstance(result, dict)
+        and isinstance(result.get("optimizedRoutes"), list)
+        and isinstance(result.get("unassignedDeliveries"), list)
+        and all(
+            isinstance(route, dict) and isinstance(route.get("stops"), list)
+            for route in result["optimizedRoutes"]
+        )
+    )
+
+# Tiempo máximo (segundos) para una respuesta completa del LLM
+LLM_TIMEOUT = 60
+
+# Tareas que terminan de leer un stream solo para registrar el uso de tokens
+_llm_usage_tasks = set()
+
+async def _drain_llm_usage(stream):
+    """
+    Lee el resto de un stream ya parseado: el proveedor envía el uso de
+    tokens en el último fragmento, después del JSON.
+    """
+    async def drain():
+        async with aclosing(stream):
+            async for chunk in stream:
+                if getattr(chunk, "usage_metadata", None):
+                    _log_llm_usage(chunk)
+    try:
+        await asyncio.wait_for(drain(), LLM_TIMEOUT)
+    except Exception as e:
+        logger.debug("No se pudo registrar el uso de tokens: %s", e)
+
+async def _stream_llm_json(llm, messages) -> Dict:
+    """
+    Lee la respuesta del LLM en streaming y la parsea en cuanto el primer
+    objeto JSON se cierra, sin esperar al resto de la generación. Cada
+    fragmento se escanea una sola vez y orjson parsea una sola vez.
     """
+    scanner = _JsonScanner()
+    stream = llm.astream(messages)
+    try:
+        async for chunk in stream:
+            if getattr(chunk, "usage_metadata", None):
+                _log_llm_usage(chunk)
+            content = chunk.content if hasattr(chunk, 'content') else str(chunk)
+            json_text = scanner.feed(content)
+            if json_text is None:
+                continue
+            result = orjson.loads(json_text)
+            if logger.isEnabledFor(logging.DEBUG):
+                # El uso llega al final: se registra en segundo plano sin
+                # retrasar la respuesta
+                task = asyncio.create_task(_drain_llm_usage(stream))
+                _llm_usage_tasks.add(task)
+                task.add_done_callback(_llm_usage_tasks.discard)
+                stream = None
+            return result
+    finally:
+        if stream is not None:
+            await stream.aclose()
+    raise ValueError("No se encontró JSON válido en la respuesta")
+
+async def llm_optimize_routes(deliveries_data: List[Dict], fleet_data: List[Dict], llm) -> Dict:
+    """
+    Usa LLM para optimizar rutas de manera más inteligente.
+    """
+    messages = [
+        ("system", OPTIMIZATION_SYSTEM_PROMPT),
+        ("human", f"""
+    ENTREGAS: {orjson.dumps(deliveries_data).decode()}
+    VEHÍCULOS: {orjson.dumps(fleet_data).decode()}
+    """),
+    ]
     
     try:
-        response = await llm.ainvoke(prompt)
-        result_text = response.content if hasattr(response, 'content') else str(response)
-        
-        # Extraer JSON del texto
-        import re
-        json_match = re.search(r'\{.*\}', result_text, re.DOTALL)
-        if json_match:
-            return json.loads(json_match.group())
-        else:
-            raise ValueError("No se encontró JSON válido en la respuesta")
+        # Streaming con límite de tiempo total; se corta al cerrarse el JSON
+        result = await asyncio.wait_for(_stream_llm_json(llm, messages), LLM_TIMEOUT)
+        if not is_valid_routes_result(result):
+            raise ValueError("La respuesta del LLM no tiene la estructura esperada")
+        return result
             
     except Exception as e:
-        print(f"Error con LLM: {e}")
+        logger.warning("Error con LLM: %s", e)
         # Fallback al algoritmo básico - agregar marca para identificarlo
-        result = route_optimization_tool(deliveries_data, fleet_data)
+        result = await run_basic_optimization(deliveries_data, fleet_data)
         result["_internal_fallback"] = True  # Marca interna
         return result
 
+# Por encima de este número de entregas el problema se parte para el LLM
+LLM_MAX_ITEMS_PER_SHARD = 64
+
+def _split_problem(deliveries_data: List[Dict], fleet_data: List[Dict], shards: int) -> List[Tuple[List[Dict], List[Dict]]]:
+    """
+    Reparto determinista y equilibrado: las entregas se ordenan por peso
+    decreciente y se reparten en round-robin entre shards. Si hay vehículos
+    para todos, la flota se reparte igual; si no, cada shard recibe todos los
+    vehículos con una parte igual de su capacidad.
+    """
+    deliveries_sorted = sorted(deliveries_data, key=itemgetter('weight'), reverse=True)
+    if shards <= len(fleet_data):
+        fleet_sorted = sorted(fleet_data, key=itemgetter('capacity'), reverse=True)
+        fleets = [fleet_sorted[i::shards] for i in range(shards)]
+    else:
+        shared_fleet = [{**vehicle, 'capacity': vehicle['capacity'] / shards} for vehicle in fleet_data]
+        fleets = [shared_fleet] * shards
+    return [(deliveries_sorted[i::shards], fleets[i]) for i in range(shards)]
+
+def _fleet_route_ids(fleet_data: List[Dict]) -> Dict[str, str]:
+    """routeId de cada vehículo según su posición en la flota del request."""
+    route_ids: Dict[str, str] = {}
+    for index, vehicle in enumerate(fleet_data):
+        route_ids.setdefault(vehicle['id'], f"RUTA-{vehicle['id']}-{index}")
+    return route_ids
+
+def _merge_shard_results(results: List[Dict], route_ids: Dict[str, str]) -> Tuple[Dict, int]:
+    """
+    Une los resultados de los shards en una ruta por vehículo. Las rutas del
+    algoritmo básico (shards con fallback) se renombran con la posición del
+    vehículo en la flota completa. Devuelve el resultado y los fallbacks.
+    """
+    merged = {"optimizedRoutes": [], "unassignedDeliveries": []}
+    routes_by_vehicle: Dict[str, Dict] = {}
+    fallbacks = 0
+    for result in results:
+        used_fallback = result.pop("_internal_fallback", False)
+        fallbacks += bool(used_fallback)
+        for route in result["optimizedRoutes"]:
+            vehicle_id = route.get("vehicleId")
+            existing = routes_by_vehicle.get(vehicle_id)
+            if existing is None:
+                if used_fallback:
+                    route["routeId"] = route_ids[vehicle_id]
+                routes_by_vehicle[vehicle_id] = route
+                merged["optimizedRoutes"].append(route)
+            else:
+                existing["stops"].extend(route["stops"])
+                existing["totalWeight"] = existing.get("totalWeight", 0) + route.get("totalWeight", 0)
+        merged["unassignedDeliveries"].extend(result["unassignedDeliveries"])
+    return merged, fallbacks
+
+def _assign_leftovers(result: Dict, deliveries_data: List[Dict], fleet_data: List[Dict], route_ids: Dict[str, str]):
+    """
+    Segunda pasada con el algoritmo básico: las entregas sin asignar de los
+    shards se reparten con la capacidad sobrante de toda la flota.
+    """
+    deliveries_by_id = {delivery['id']: delivery for delivery in deliveries_data}
+
+    def stop_weight(stop) -> float:
+        delivery = stop if isinstance(stop, dict) else deliveries_by_id.get(stop, {})
+        return delivery.get('weight', 0)
+
+    used_capacity: Dict[str, float] = {}
+    routes_by_vehicle: Dict[str, Dict] = {}
+    for route in result["optimizedRoutes"]:
+        vehicle_id = route.get("vehicleId")
+        routes_by_vehicle.setdefault(vehicle_id, route)
+        used_capacity[vehicle_id] = used_capacity.get(vehicle_id, 0) + sum(
+            stop_weight(stop) for stop in route["stops"]
+        )
+
+    leftover_fleet = [
+        {**vehicle, 'capacity': vehicle['capacity'] - used_capacity.get(vehicle['id'], 0)}
+        for vehicle in fleet_data
+        if vehicle['capacity'] - used_capacity.get(vehicle['id'], 0) > 0
+    ]
+    pending, unknown = [], []
+    for item in result["unassignedDeliveries"]:
+        delivery = item if isinstance(item, dict) else deliveries_by_id.get(item)
+        if delivery is not None and 'weight' in delivery:
+            pending.append(delivery)
+        else:
+            unknown.append(item)
+
+    second_pass = route_optimization_tool(pending, leftover_fleet)
+    for route in second_pass["optimizedRoutes"]:
+        existing = routes_by_vehicle.get(route["vehicleId"])
+        if existing is None:
+            # El índice de route_optimization_tool es el de leftover_fleet
+            route["routeId"] = route_ids[route["vehicleId"]]
+            result["optimizedRoutes"].append(route)
+        else:
+            existing["stops"].extend(route["stops"])
+            existing["totalWeight"] = existing.get("totalWeight", 0) + route["totalWeight"]
+    result["unassignedDeliveries"] = second_pass["unassignedDeliveries"] + unknown
+
+async def llm_optimize_routes_sharded(deliveries_data: List[Dict], fleet_data: List[Dict], llm) -> Dict:
+    """
+    Parte un problema grande en subproblemas de hasta LLM_MAX_ITEMS_PER_SHARD
+    entregas y los resuelve en paralelo; el tiempo total es el del shard más
+    lento. Si todos los shards usaron el fallback el resultado lleva
+    _internal_fallback; si solo algunos, _partial_fallback = (fallbacks, shards).
+    """
+    shards = ceil(len(deliveries_data) / LLM_MAX_ITEMS_PER_SHARD)
+    results = await asyncio.gather(*(
+        llm_optimize_routes(shard_deliveries, shard_fleet, llm)
+        for shard_deliveries, shard_fleet in _split_problem(deliveries_data, fleet_data, shards)
+    ))
+
+    route_ids = _fleet_route_ids(fleet_data)
+    merged, fallbacks = _merge_shard_results(results, route_ids)
+    if merged["unassignedDeliveries"]:
+        await asyncio.to_thread(_assign_leftovers, merged, deliveries_data, fleet_data, route_ids)
+    if fallbacks == shards:
+        merged["_internal_fallback"] = True
+    elif fallbacks:
+        merged["_partial_fallback"] = (fallbacks, shards)
+    return merged
+
+def _result_belongs_to(result: Dict, deliveries_data: List[Dict], fleet_data: List[Dict]) -> bool:
+    """True si todas las entregas y vehículos del resultado son de este problema."""
+    delivery_ids = {delivery['id'] for delivery in deliveries_data}
+    vehicle_ids = {vehicle['id'] for vehicle in fleet_data}
+
+    def delivery_id(item):
+        return item.get('id') if isinstance(item, dict) else item
+
+    return all(
+        route.get("vehicleId") in vehicle_ids
+        and all(delivery_id(stop) in delivery_ids for stop in route["stops"])
+        for route in result["optimizedRoutes"]
+    ) and all(delivery_id(item) in delivery_ids for item in result["unassignedDeliveries"])
+
+async def llm_optimize_routes_batch(problems: List[Tuple[List[Dict], List[Dict]]], llm) -> List[Dict]:
+    """
+    Resuelve varios problemas independientes con una sola llamada al LLM.
+    Lanza ValueError si la respuesta no trae un resultado por problema.
+    """
+    problems_text = "\n".join(
+        f"""
+    PROBLEMA {index}:
+    ENTREGAS: {orjson.dumps(deliveries_data).decode()}
+    VEHÍCULOS: {orjson.dumps(fleet_data).decode()}"""
+        for index, (deliveries_data, fleet_data) in enumerate(problems, start=1)
+    )
+    messages = [
+        ("system", BATCH_OPTIMIZATION_SYSTEM_PROMPT),
+        ("human", f"""
+    Resuelve estos {len(problems)} problemas:
+    {problems_text}
+    """),
+    ]
+
+    # Mismo límite que la ruta individual: un timeout cae en el fallback por problema
+    response = await asyncio.wait_for(llm.ainvoke(messages), LLM_TIMEOUT)
+    _log_llm_usage(response)
+    result_text = response.content if hasattr(response, 'content') else str(response)
+
+    results = orjson.loads(extract_json(result_text, opening="["))
+    if len(results) != len(problems) or not all(map(is_valid_routes_result, results)):
+        raise ValueError("La respuesta no contiene un resultado por problema")
+    # Cada problema viene de un request distinto: un resultado con datos de
+    # otro problema no puede llegar (ni cachearse) para este cliente
+    for result, (deliveries_data, fleet_data) in zip(results, problems):
+        if not _result_belongs_to(result, deliveries_data, fleet_data):
+            raise ValueError("La respuesta mezcla datos de distintos problemas")
+    return results
+
+def has_valid_openai_key(openai_key: str) -> bool:
+    """
+    Comprobación barata de formato: evita llamar a OpenAI (y acabar en el
+    fallback) con la key de demo o con el placeholder de .env.example.
+    """
+    return (
+        openai_key.startswith("sk-")
+        and len(openai_key) > 20
+        and openai_key != "sk-fake-key-for-demo"
+    )
+
+# Configuración leída una sola vez al arrancar; no cambia entre peticiones
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openai").lower()
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "sk-fake-key-for-demo")
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.2")
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+HAS_VALID_OPENAI_KEY = has_valid_openai_key(OPENAI_API_KEY)
+# Ollama no necesita API key; con la key de demo ni siquiera se intenta
+CAN_USE_LLM = LLM_AVAILABLE and (LLM_PROVIDER == "ollama" or HAS_VALID_OPENAI_KEY)
+
+@lru_cache(maxsize=1)
+def get_llm_http_client():
+    """
+    Cliente HTTP compartido por todas las llamadas a OpenAI: mantiene las
+    conexiones abiertas (keep-alive, HTTP/2) en lugar de reabrirlas.
+    """
+    import httpx
+    return httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        timeout=30
+    )
+
 # Configurar LLM si está disponible
-llm = None
-if LLM_AVAILABLE:
+@lru_cache(maxsize=1)
+def get_llm():
+    """
+    Crea el cliente LLM en el primer uso y lo reutiliza después.
+    Devuelve None si no está disponible o falla su configuración.
+    """
+    if not LLM_AVAILABLE:
+        return None
     try:
-        llm_provider = os.getenv("LLM_PROVIDER", "openai").lower()
-        
-        if llm_provider == "ollama":
-            ollama_model = os.getenv("OLLAMA_MODEL", "llama3.2")
-            ollama_base_url = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
-            llm = ChatOllama(
-                model=ollama_model,
-                base_url=ollama_base_url,
+        if LLM_PROVIDER == "ollama":
+            from langchain_ollama import ChatOllama
+            return ChatOllama(
+                model=OLLAMA_MODEL,
+                base_url=OLLAMA_BASE_URL,
                 temperature=0.1
             )
         else:
             # Default a OpenAI
-            llm = ChatOpenAI(
+            from langchain_openai import ChatOpenAI
+            return ChatOpenAI(
                 model="gpt-3.5-turbo",
                 temperature=0.1,
-                api_key=os.getenv("OPENAI_API_KEY", "sk-fake-key-for-demo")
+                api_key=OPENAI_API_KEY,
+                # Uso de tokens (incluida la caché) en el último fragmento del stream
+                stream_usage=True,
+                http_async_client=get_llm_http_client()
             )
     except Exception as e:
-        print(f"Error configurando LLM: {e}")
-        LLM_AVAILABLE = False
-
-# Modelos Pydantic
-class DeliveryItem(BaseModel):
-    id: str
-    weight: float = Field(gt=0, description="Weight must be positive")
-    orderId: Optional[str] = None
-    address: Optional[str] = None
-    priority: Optional[int] = None
-
-class VehicleItem(BaseModel):
-    id: str
-    capacity: float = Field(gt=0, description="Capacity must be positive")
-    type: Optional[str] = None
-    location: Optional[str] = None
-
-class OptimizationRequest(BaseModel):
-    deliveries: List[DeliveryItem]
-    fleet: List[VehicleItem]
-
-    @validator('deliveries')
-    def deliveries_not_empty(cls, v):
-        if not v:
-            raise ValueError('La lista de entregas no puede estar vacía')
-        return v
-
-    @validator('fleet')
-    def fleet_not_empty(cls, v):
-        if not v:
-            raise ValueError('La lista de vehículos no puede estar vacía')
-        return v
+        logger.error("Error configurando LLM: %s", e)
+        return None
+
+async def get_llm_async():
+    """
+    get_llm() sin bloquear el event loop: la primera llamada importa
+    langchain y crea el cliente en un hilo; las siguientes usan la caché.
+    """
+    if get_llm.cache_info().currsize:
+        return get_llm()
+    return await asyncio.to_thread(get_llm)
+
+async def llm_client_ready() -> bool:
+    """True si el LLM se va a usar y su cliente se creó correctamente."""
+    return CAN_USE_LLM and await get_llm_async() is not None
+
+# Micro-batching: las peticiones al LLM que llegan en la misma ventana
+# se resuelven con una sola llamada
+LLM_BATCH_MAX_SIZE = 8
+LLM_BATCH_WINDOW = 0.02  # segundos
+
+llm_queue: Optional[asyncio.Queue] = None
+_llm_batch_tasks = set()
+
+async def _solve_llm_batch(batch: List[Tuple[List[Dict], List[Dict], asyncio.Future]]):
+    """Resuelve un lote y entrega cada resultado a su petición."""
+    llm = get_llm()
+    try:
+        if len(batch) == 1:
+            deliveries_data, fleet_data, _ = batch[0]
+            results = [await llm_optimize_routes(deliveries_data, fleet_data, llm)]
+        else:
+            try:
+                results = await llm_optimize_routes_batch([(d, f) for d, f, _ in batch], llm)
+            except Exception as e:
+                logger.warning("Error con LLM en lote de %d problemas: %s", len(batch), e)
+                # Cada problema por separado, con su propio fallback
+                results = await asyncio.gather(*(
+                    llm_optimize_routes(d, f, llm) for d, f, _ in batch
+                ))
+        for (_, _, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+    except Exception as e:
+        for _, _, future in batch:
+            if not future.done():
+                future.set_exception(e)
+
+async def _collect_llm_batches(queue: asyncio.Queue):
+    """Agrupa hasta LLM_BATCH_MAX_SIZE peticiones o LLM_BATCH_WINDOW segundos."""
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await queue.get()]
+        deadline = loop.time() + LLM_BATCH_WINDOW
+        while len(batch) < LLM_BATCH_MAX_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        # Resolver en segundo plano para seguir recogiendo el siguiente lote
+        task = asyncio.create_task(_solve_llm_batch(batch))
+        _llm_batch_tasks.add(task)
+        task.add_done_callback(_llm_batch_tasks.discard)
+
+# Caché exacta de respuestas del LLM: mismo payload, mismo resultado.
+# Solo se accede desde el event loop, por lo que no necesita lock.
+llm_cache = TTLCache(maxsize=10_000, ttl=3600)
+
+def _llm_cache_key(deliveries_data: List[Dict], fleet_data: List[Dict]) -> bytes:
+    """Hash del payload canónico (claves ordenadas) para la caché del LLM."""
+    canonical = orjson.dumps(
+        {"deliveries": deliveries_data, "fleet": fleet_data},
+        option=orjson.OPT_SORT_KEYS
+    )
+    return blake2b(canonical, digest_size=16).digest()
+
+async def optimize_with_llm(deliveries_data: List[Dict], fleet_data: List[Dict]) -> Dict:
+    """
+    Devuelve el resultado cacheado si existe; si no, encola el problema para
+    el próximo lote (o llama directo si no hay worker activo).
+    El resultado lleva la marca interna _cache_hit.
+    """
+    cache_key = _llm_cache_key(deliveries_data, fleet_data)
+    cached = llm_cache.get(cache_key)
+    if cached is not None:
+        return {**cached, "_cache_hit": True}
+
+    if len(deliveries_data) > LLM_MAX_ITEMS_PER_SHARD:
+        # Demasiado grande para un solo prompt (o para agruparlo con otros)
+        result = await llm_optimize_routes_sharded(deliveries_data, fleet_data, get_llm())
+    elif llm_queue is None:
+        result = await llm_optimize_routes(deliveries_data, fleet_data, get_llm())
+    else:
+        future = asyncio.get_running_loop().create_future()
+        await llm_queue.put((deliveries_data, fleet_data, future))
+        result = await future
+
+    # Solo se cachean respuestas reales y bien formadas del LLM, no los
+    # fallbacks (ni los parciales: un reintento puede resolverlo todo)
+    if (
+        not result.get("_internal_fallback")
+        and not result.get("_partial_fallback")
+        and is_valid_routes_result(result)
+    ):
+        llm_cache[cache_key] = dict(result)
+    return {**result, "_cache_hit": False}
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global llm_queue
+    llm_queue = asyncio.Queue()
+    worker = asyncio.create_task(_collect_llm_batches(llm_queue))
+    try:
+        yield
+    finally:
+        worker.cancel()
+        llm_queue = None
+        # Cerrar el cliente HTTP solo si llegó a crearse
+        if get_llm_http_client.cache_info().currsize:
+            await get_llm_http_client().aclose()
+        # Un arranque posterior en el mismo proceso crea clientes nuevos en
+        # lugar de reutilizar un ChatOpenAI ligado al cliente cerrado
+        get_llm.cache_clear()
+        get_llm_http_client.cache_clear()
 
 # FastAPI App
 app = FastAPI(
     title="AI Logistics Optimization API",
     description="API para optimización de rutas logísticas usando LLM (OpenAI/Ollama)",
-    version="3.0.0"
+    version="3.0.0",
+    lifespan=lifespan
 )
 
 app.add_middleware(
@@ -177,28 +600,62 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Las respuestas con todas las paradas se comprimen bien (JSON repetitivo)
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
+# Pool de hilos para el algoritmo básico; el kernel de Numba libera el GIL (nogil=True)
+batch_executor = ThreadPoolExecutor(max_workers=os.cpu_count())
+
+async def run_basic_optimization(deliveries_data: List[Dict], fleet_data: List[Dict]) -> Dict:
+    """Ejecuta el algoritmo básico en el pool de hilos, fuera del event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(batch_executor, route_optimization_tool, deliveries_data, fleet_data)
+
+# Con más paradas que esto la respuesta se envía ruta a ruta
+STREAMING_MIN_STOPS = 5000
+
+def _stream_optimization_result(result: Dict):
+    """Serializa el resultado por partes para no construir todo el JSON en memoria."""
+    yield b'{"optimizedRoutes":['
+    for index, route in enumerate(result["optimizedRoutes"]):
+        if index:
+            yield b","
+        yield orjson.dumps(route)
+    yield b"]"
+    # Resto de claves (unassignedDeliveries, metadatos) sin la llave inicial
+    rest = orjson.dumps({key: value for key, value in result.items() if key != "optimizedRoutes"})
+    yield b"," + rest[1:] if len(rest) > 2 else b"}"
+
+def optimization_response(result: Dict) -> Response:
+    """JSON de orjson en un solo bloque para resultados normales; streaming para los muy grandes."""
+    total_stops = sum(len(route["stops"]) for route in result["optimizedRoutes"])
+    if total_stops < STREAMING_MIN_STOPS:
+        return Response(content=orjson.dumps(result), media_type="application/json")
+    return StreamingResponse(_stream_optimization_result(result), media_type="application/json")
+
 @app.post("/api/optimize-routes")
 async def optimize_routes_endpoint(request: OptimizationRequest):
-    """Optimiza rutas usando LLM (OpenAI/Ollama) o algoritmo básico."""
+    """
+    Optimiza rutas usando LLM (OpenAI/Ollama) o algoritmo básico.
+
+    Devuelve la respuesta ya construida: un dict devuelto pasaría antes por
+    jsonable_encoder, que recorre toda la respuesta en Python.
+    """
     try:
-        print("Iniciando optimización...")
-        
-        deliveries_data = [d.dict() for d in request.deliveries]
-        fleet_data = [v.dict() for v in request.fleet]
+        logger.debug("Iniciando optimización: entregas=%d vehículos=%d", len(request.deliveries), len(request.fleet))
         
-        # Verificar si podemos usar LLM
-        can_use_llm = False
-        if LLM_AVAILABLE and llm:
-            llm_provider = os.getenv("LLM_PROVIDER", "openai").lower()
-            if llm_provider == "ollama":
-                can_use_llm = True  # Ollama no necesita API key
-            elif os.getenv("OPENAI_API_KEY") and os.getenv("OPENAI_API_KEY") != "sk-fake-key-for-demo":
-                can_use_llm = True
+        # Una sola pasada del serializador de pydantic-core para todo el request
+        payload = request.model_dump()
+        deliveries_data = payload["deliveries"]
+        fleet_data = payload["fleet"]
         
-        if can_use_llm:
+        # El cliente solo se crea cuando de verdad se va a usar
+        llm = await get_llm_async() if CAN_USE_LLM else None
+        if llm is not None:
             try:
-                print(f"Usando LLM ({os.getenv('LLM_PROVIDER', 'openai')}) para optimización...")
-                result = await llm_optimize_routes(deliveries_data, fleet_data, llm)
+                logger.debug("Usando LLM (%s) para optimización", LLM_PROVIDER)
+                result = await optimize_with_llm(deliveries_data, fleet_data)
+                cache_hit = result.pop("_cache_hit")  # Remover marca interna
                 
                 # Verificar si el resultado viene del LLM o del fallback interno
                 if result.get("_internal_fallback"):
@@ -206,85 +663,144 @@ async def optimize_routes_endpoint(request: OptimizationRequest):
                     result.pop("_internal_fallback", None)  # Remover marca interna
                     result["optimization_method"] = "basic_algorithm_after_llm_error"
                     result["llm_used"] = False
-                    result["message"] = f"LLM ({os.getenv('LLM_PROVIDER', 'openai')}) falló. Usando algoritmo básico."
+                    result["message"] = f"LLM ({LLM_PROVIDER}) falló. Usando algoritmo básico."
+                elif result.get("_partial_fallback"):
+                    # Problema partido en shards: solo algunos usaron el fallback
+                    fallbacks, shards = result.pop("_partial_fallback")
+                    result["optimization_method"] = f"llm_{LLM_PROVIDER}_partial"
+                    result["llm_used"] = True
+                    result["message"] = (
+                        f"Optimización realizada con {LLM_PROVIDER.upper()}; "
+                        f"{fallbacks} de {shards} subproblemas con algoritmo básico"
+                    )
                 else:
                     # Si llm_optimize_routes devolvió resultado del LLM
-                    result["optimization_method"] = f"llm_{os.getenv('LLM_PROVIDER', 'openai')}"
+                    result["optimization_method"] = f"llm_{LLM_PROVIDER}"
                     result["llm_used"] = True
-                    result["message"] = f"Optimización realizada con {os.getenv('LLM_PROVIDER', 'openai').upper()}"
+                    result["message"] = f"Optimización realizada con {LLM_PROVIDER.upper()}"
                 
-                return result
+                response = optimization_response(result)
+                response.headers["X-Cache"] = "HIT" if cache_hit else "MISS"
+                return response
                     
             except Exception as e:
-                print(f"Error con LLM: {e}")
+                logger.warning("Error con LLM: %s", e)
                 # Fallback explícito
-                result = route_optimization_tool(deliveries_data, fleet_data)
+                result = await run_basic_optimization(deliveries_data, fleet_data)
                 result["optimization_method"] = "basic_algorithm_after_llm_exception"
                 result["llm_used"] = False
-                result["message"] = f"Excepción en LLM ({os.getenv('LLM_PROVIDER', 'openai')}). Usando algoritmo básico."
-                return result
+                result["message"] = f"Excepción en LLM ({LLM_PROVIDER}). Usando algoritmo básico."
+                return optimization_response(result)
         
         # Fallback al algoritmo básico
-        print("Usando algoritmo básico...")
-        result = route_optimization_tool(deliveries_data, fleet_data)
+        logger.debug("Usando algoritmo básico")
+        # Fuera del event loop para no bloquear otras peticiones con entradas grandes
+        result = await run_basic_optimization(deliveries_data, fleet_data)
         result["optimization_method"] = "basic_algorithm"
         result["llm_used"] = False
         result["message"] = "Optimización realizada con algoritmo básico"
-        return result
+        return optimization_response(result)
             
     except Exception as e:
-        print(f"Error general: {str(e)}")
+        logger.exception("Error general: %s", e)
         raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
 
-@app.get("/")
-def read_root():
-    return {
-        "message": "AI Logistics API está activo",
-        "status": "healthy",
-        "version": "3.0.0",
-        "llm_available": LLM_AVAILABLE,
-        "supported_providers": ["openai", "ollama"]
-    }
+def _basic_optimization(payload: Dict) -> Dict:
+    """Ejecuta el algoritmo básico sobre un request ya convertido a dict."""
+    result = route_optimization_tool(payload["deliveries"], payload["fleet"])
+    result["optimization_method"] = "basic_algorithm"
+    result["llm_used"] = False
+    result["message"] = "Optimización realizada con algoritmo básico"
+    return result
 
-@app.get("/health")
-def health_check():
-    return {"status": "healthy", "service": "ai-logistics"}
+@app.post("/api/optimize-routes-batch")
+async def optimize_routes_batch_endpoint(requests: List[OptimizationRequest]):
+    """Optimiza varios problemas independientes en paralelo con el algoritmo básico."""
+    try:
+        # Un único recorrido de pydantic-core para todo el lote
+        payloads = OPTIMIZATION_BATCH.dump_python(requests)
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(*(
+            loop.run_in_executor(batch_executor, _basic_optimization, payload)
+            for payload in payloads
+        ))
+        return Response(content=orjson.dumps(results), media_type="application/json")
+    except Exception as e:
+        logger.exception("Error general: %s", e)
+        raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
 
-@app.get("/llm-status")
-def llm_status():
-    """Verificar el estado del LLM y configuración."""
-    llm_provider = os.getenv("LLM_PROVIDER", "openai").lower()
-    openai_key = os.getenv("OPENAI_API_KEY", "")
-    has_valid_openai_key = openai_key and openai_key != "sk-fake-key-for-demo" and len(openai_key) > 10
-    
-    can_use_llm = False
+def _compute_llm_status(llm_ready: bool) -> Dict:
+    """Estado del LLM según la configuración y si su cliente llegó a crearse."""
     llm_info = {}
     
-    if LLM_AVAILABLE:
-        if llm_provider == "ollama":
-            can_use_llm = True
+    if llm_ready:
+        if LLM_PROVIDER == "ollama":
             llm_info = {
                 "provider": "ollama",
-                "model": os.getenv("OLLAMA_MODEL", "llama3.2"),
-                "base_url": os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+                "model": OLLAMA_MODEL,
+                "base_url": OLLAMA_BASE_URL
             }
-        elif has_valid_openai_key:
-            can_use_llm = True
+        else:
             llm_info = {
                 "provider": "openai",
                 "model": "gpt-3.5-turbo"
             }
     
     return {
-        "llm_available": LLM_AVAILABLE,
-        "llm_provider": llm_provider,
+        # Falso también si las librerías están pero configurar el cliente falló
+        "llm_available": LLM_AVAILABLE and (llm_ready or not CAN_USE_LLM),
+        "llm_provider": LLM_PROVIDER,
         "llm_info": llm_info,
-        "openai_key_configured": has_valid_openai_key,
-        "will_use_llm": can_use_llm,
+        "openai_key_configured": HAS_VALID_OPENAI_KEY,
+        "will_use_llm": llm_ready,
         "fallback_method": "basic_algorithm",
-        "message": f"LLM listo con {llm_provider}" if can_use_llm else "Usando algoritmo básico"
+        "message": f"LLM listo con {LLM_PROVIDER}" if llm_ready else "Usando algoritmo básico"
     }
 
+@lru_cache(maxsize=2)
+def _status_responses(llm_ready: bool) -> Tuple[bytes, bytes]:
+    """Cuerpos de / y /llm-status, serializados una vez por estado del cliente."""
+    llm_status = _compute_llm_status(llm_ready)
+    root = orjson.dumps({
+        "message": "AI Logistics API está activo",
+        "status": "healthy",
+        "version": "3.0.0",
+        "llm_available": llm_status["llm_available"],
+        "supported_providers": ["openai", "ollama"]
+    })
+    return root, orjson.dumps(llm_status)
+
+# Respuesta estática serializada una sola vez al importar
+HEALTH_RESPONSE = orjson.dumps({"status": "healthy", "service": "ai-logistics"})
+
+@app.get("/")
+async def read_root():
+    root_response, _ = _status_responses(await llm_client_ready())
+    return Response(content=root_response, media_type="application/json")
+
+@app.get("/health")
+async def health_check():
+    return Response(content=HEALTH_RESPONSE, media_type="application/json")
+
+@app.get("/llm-status")
+async def llm_status():
+    """Verificar el estado del LLM y configuración."""
+    _, llm_status_response = _status_responses(await llm_client_ready())
+    return Response(content=llm_status_response, media_type="application/json")
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    if os.getenv("DEV", "").lower() in ("1", "true"):
+        # Recarga automática: un solo proceso, solo para desarrollo
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    else:
+        uvicorn.run(
+            "main:app",
+            host="0.0.0.0",
+            port=8000,
+            workers=os.cpu_count(),
+            loop="uvloop",
+            http="httptools",
+            log_level="warning",
+            access_log=False
+        )
\ No newline at end of file
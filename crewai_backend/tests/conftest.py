@@ -0,0 +1,7 @@
+# crewai_backend/tests/conftest.py
+import sys
+from pathlib import Path
+
+# main.py importa `core` como módulo de primer nivel: los tests se ejecutan
+# con crewai_backend/ en el path, igual que el servidor
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,82 @@
+# crewai_backend/tests/test_api.py
+import asyncio
+
+import orjson
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+@pytest.fixture
+def client(monkeypatch):
+    # Sin LLM: los endpoints usan siempre el algoritmo básico
+    monkeypatch.setattr(main, "CAN_USE_LLM", False)
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+def _problem(prefix: str, weights, capacities):
+    return {
+        "deliveries": [{"id": f"{prefix}-d{i}", "weight": weight} for i, weight in enumerate(weights)],
+        "fleet": [{"id": f"{prefix}-v{j}", "capacity": capacity} for j, capacity in enumerate(capacities)],
+    }
+
+def test_optimize_routes_basic(client):
+    response = client.post("/api/optimize-routes", json=_problem("p", [30, 20, 50, 200], [50, 50]))
+    assert response.status_code == 200
+    body = response.json()
+    assert body["optimization_method"] == "basic_algorithm"
+    assert body["llm_used"] is False
+    assert [delivery["id"] for delivery in body["unassignedDeliveries"]] == ["p-d3"]
+    assert sum(len(route["stops"]) for route in body["optimizedRoutes"]) == 3
+
+def test_optimize_routes_rejects_empty_lists(client):
+    response = client.post("/api/optimize-routes", json={"deliveries": [], "fleet": []})
+    assert response.status_code == 422
+
+def test_batch_matches_individual_requests(client):
+    problems = [
+        _problem("a", [30, 20, 50], [50, 50]),
+        _problem("b", [1, 2, 3, 4], [5]),
+        _problem("c", [10, 10], [5]),
+    ]
+    response = client.post("/api/optimize-routes-batch", json=problems)
+    assert response.status_code == 200
+    batch = response.json()
+    assert len(batch) == len(problems)
+    for problem, result in zip(problems, batch):
+        single = client.post("/api/optimize-routes", json=problem).json()
+        assert result == single
+
+def test_batch_rejects_invalid_item(client):
+    problems = [_problem("a", [1], [5]), {"deliveries": [], "fleet": [{"id": "v", "capacity": 1}]}]
+    assert client.post("/api/optimize-routes-batch", json=problems).status_code == 422
+
+def test_large_result_is_streamed_as_same_json(client, monkeypatch):
+    problem = _problem("s", [1] * (main.STREAMING_MIN_STOPS + 100), [1000] * 10)
+    streamed = client.post("/api/optimize-routes", json=problem)
+    monkeypatch.setattr(main, "STREAMING_MIN_STOPS", 10**9)
+    buffered = client.post("/api/optimize-routes", json=problem)
+    assert "content-length" not in streamed.headers
+    assert "content-length" in buffered.headers
+    assert streamed.json() == buffered.json()
+
+@pytest.mark.parametrize("result", [
+    {"optimizedRoutes": [{"routeId": "R", "stops": [1, 2]}, {"routeId": "S", "stops": [3]}], "unassignedDeliveries": []},
+    {"optimizedRoutes": []},
+    {"optimizedRoutes": [{"routeId": "R", "stops": [1]}]},
+])
+def test_stream_optimization_result_is_valid_json(result):
+    assert orjson.loads(b"".join(main._stream_optimization_result(result))) == result
+
+def test_lifespan_restart_creates_fresh_llm_clients():
+    async def run():
+        async with main.lifespan(main.app):
+            first = main.get_llm_http_client()
+        assert first.is_closed
+        async with main.lifespan(main.app):
+            second = main.get_llm_http_client()
+            assert second is not first
+            assert not second.is_closed
+        main.get_llm_http_client.cache_clear()
+
+    asyncio.run(run())
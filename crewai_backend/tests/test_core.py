@@ -0,0 +1,103 @@
+# crewai_backend/tests/test_core.py
+import random
+
+import pytest
+
+import core
+from core import route_optimization_tool
+
+def _random_problem(rng: random.Random, deliveries: int, vehicles: int):
+    """Problema con muchos pesos repetidos, como paquetes estándar."""
+    standard_weights = [0.1, 0.5, 1, 1.5, 2, 2.5, 3, 7]
+    weights = [
+        rng.choice(standard_weights) if rng.random() < 0.8 else round(rng.uniform(0.1, 10), 1)
+        for _ in range(deliveries)
+    ]
+    capacities = [rng.choice([0.3, 5, 7.5, 10, 20]) for _ in range(vehicles)]
+    return weights, capacities
+
+def _reference_best_fit(weights, capacities):
+    """Best-Fit Decreasing entrega a entrega, sin atajos."""
+    remaining = list(capacities)
+    assignment = [-1] * len(weights)
+    for i in sorted(range(len(weights)), key=weights.__getitem__, reverse=True):
+        candidates = [v for v in range(len(remaining)) if remaining[v] >= weights[i]]
+        if candidates:
+            best = min(candidates, key=lambda v: (remaining[v], v))
+            remaining[best] -= weights[i]
+            assignment[i] = best
+    return assignment
+
+def _as_dicts(weights, capacities):
+    deliveries = [{"id": f"d{i}", "weight": weight} for i, weight in enumerate(weights)]
+    fleet = [{"id": f"v{j}", "capacity": capacity} for j, capacity in enumerate(capacities)]
+    return deliveries, fleet
+
+@pytest.mark.parametrize("size", [5, 63, 64, 300])
+def test_capacity_is_never_exceeded(size):
+    rng = random.Random(size)
+    for _ in range(50):
+        deliveries, fleet = _as_dicts(*_random_problem(rng, size, rng.randint(1, 12)))
+        result = route_optimization_tool(deliveries, fleet)
+        capacities = {vehicle["id"]: vehicle["capacity"] for vehicle in fleet}
+        for route in result["optimizedRoutes"]:
+            total = sum(stop["weight"] for stop in route["stops"])
+            assert total <= capacities[route["vehicleId"]] + 1e-9
+            assert route["totalWeight"] == pytest.approx(total)
+
+@pytest.mark.parametrize("size", [5, 63, 64, 300])
+def test_every_delivery_is_assigned_or_unassigned(size):
+    rng = random.Random(size)
+    for _ in range(50):
+        deliveries, fleet = _as_dicts(*_random_problem(rng, size, rng.randint(1, 12)))
+        result = route_optimization_tool(deliveries, fleet)
+        assigned = [stop["id"] for route in result["optimizedRoutes"] for stop in route["stops"]]
+        unassigned = [delivery["id"] for delivery in result["unassignedDeliveries"]]
+        assert sorted(assigned + unassigned) == sorted(delivery["id"] for delivery in deliveries)
+
+def test_heavier_than_fleet_goes_to_unassigned():
+    deliveries = [
+        {"id": "grande", "weight": 50},
+        {"id": "a", "weight": 10},
+        {"id": "b", "weight": 5},
+    ]
+    fleet = [{"id": "v1", "capacity": 12}, {"id": "v2", "capacity": 20}]
+    result = route_optimization_tool(deliveries, fleet)
+    assert [delivery["id"] for delivery in result["unassignedDeliveries"]] == ["grande"]
+    assigned = {stop["id"] for route in result["optimizedRoutes"] for stop in route["stops"]}
+    assert assigned == {"a", "b"}
+
+def test_everything_fits_in_smallest_sufficient_vehicle():
+    deliveries = [{"id": "a", "weight": 3}, {"id": "b", "weight": 4}]
+    fleet = [{"id": "v1", "capacity": 100}, {"id": "v2", "capacity": 8}, {"id": "v3", "capacity": 6}]
+    result = route_optimization_tool(deliveries, fleet)
+    assert [route["vehicleId"] for route in result["optimizedRoutes"]] == ["v2"]
+    assert result["optimizedRoutes"][0]["routeId"] == "RUTA-v2-1"
+    assert [stop["id"] for stop in result["optimizedRoutes"][0]["stops"]] == ["a", "b"]
+
+def test_empty_inputs():
+    assert route_optimization_tool([], [{"id": "v", "capacity": 1}]) == {
+        "optimizedRoutes": [], "unassignedDeliveries": []
+    }
+    deliveries = [{"id": "a", "weight": 1}]
+    assert route_optimization_tool(deliveries, [])["unassignedDeliveries"] == deliveries
+
+def test_python_path_matches_reference(monkeypatch):
+    monkeypatch.setattr(core, "NUMPY_MIN_DELIVERIES", 10**9)
+    rng = random.Random(0)
+    for _ in range(1000):
+        weights, capacities = _random_problem(rng, rng.choice([5, 30, 200]), rng.randint(1, 12))
+        assert core._best_fit_decreasing(weights, capacities) == _reference_best_fit(weights, capacities)
+
+@pytest.mark.skipif(not core.NUMBA_AVAILABLE, reason="numba no instalado")
+def test_numba_path_matches_python_path(monkeypatch):
+    rng = random.Random(1)
+    problems = [
+        _random_problem(rng, rng.choice([5, 30, 64, 200, 1000]), rng.randint(1, 12))
+        for _ in range(3000)
+    ]
+    monkeypatch.setattr(core, "NUMPY_MIN_DELIVERIES", 0)
+    compiled = [core._best_fit_decreasing(w, c) for w, c in problems]
+    monkeypatch.setattr(core, "NUMPY_MIN_DELIVERIES", 10**9)
+    python = [core._best_fit_decreasing(w, c) for w, c in problems]
+    assert compiled == python
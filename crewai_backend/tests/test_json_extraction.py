@@ -0,0 +1,84 @@
+# crewai_backend/tests/test_json_extraction.py
+import asyncio
+import random
+
+import orjson
+import pytest
+
+import main
+from main import _JsonScanner, extract_json
+
+TRICKY = {
+    "optimizedRoutes": [{
+        "routeId": "RUTA-}{-1",
+        "vehicleId": "v\"1\"",
+        "stops": [{"id": "d]1[", "address": "C/ Mayor \\\\ 3 {bajo}"}],
+        "totalWeight": 12.5,
+    }],
+    "unassignedDeliveries": ["\\", "\"}", "]"],
+}
+
+def _feed_chunks(text: str, sizes, opening: str = "{"):
+    scanner = _JsonScanner(opening)
+    position = 0
+    for size in sizes:
+        json_text = scanner.feed(text[position:position + size])
+        position += size
+        if json_text is not None:
+            return json_text
+    return None
+
+def test_extract_json_skips_prose_and_code_fences():
+    text = "Aquí tienes el resultado:\n```json\n" + orjson.dumps(TRICKY).decode() + "\n```\nEspero que sirva {"
+    assert orjson.loads(extract_json(text)) == TRICKY
+
+def test_extract_json_ignores_delimiters_inside_strings():
+    assert extract_json('x {"a": "}]\\"{[", "b": [1, {"c": 2}]} {"z": 1}') == '{"a": "}]\\"{[", "b": [1, {"c": 2}]}'
+
+def test_extract_json_array():
+    assert extract_json('Lotes: [{"a": "]"}, 2] fin', opening="[") == '[{"a": "]"}, 2]'
+
+@pytest.mark.parametrize("text", ["sin json", '{"a": 1', '{"a": "}'])
+def test_extract_json_without_complete_json_raises(text):
+    with pytest.raises(ValueError):
+        extract_json(text)
+
+def test_backslash_at_chunk_boundary():
+    text = '{"a": "x\\"}", "b": 1}'
+    backslash = text.index("\\")
+    # Corte justo después de la barra: el escape se resuelve en el fragmento siguiente
+    json_text = _feed_chunks(text, [backslash + 1, 1, len(text)])
+    assert orjson.loads(json_text) == {"a": 'x"}', "b": 1}
+
+def test_random_chunking_matches_whole_text():
+    rng = random.Random(0)
+    text = "Respuesta:\n```json\n" + orjson.dumps(TRICKY).decode() + "\n```"
+    for _ in range(500):
+        sizes = [rng.randint(1, 3) for _ in range(len(text))]
+        assert orjson.loads(_feed_chunks(text, sizes)) == TRICKY
+
+class _Message:
+    def __init__(self, content: str):
+        self.content = content
+
+class _StreamLLM:
+    def __init__(self, text: str, chunk_size: int = 2):
+        self.text = text
+        self.chunk_size = chunk_size
+        self.closed = False
+
+    async def astream(self, messages):
+        try:
+            for index in range(0, len(self.text), self.chunk_size):
+                yield _Message(self.text[index:index + self.chunk_size])
+        finally:
+            self.closed = True
+
+def test_stream_returns_first_complete_object_and_closes_stream():
+    llm = _StreamLLM("```json\n" + orjson.dumps(TRICKY).decode() + "\n``` y más texto que no hace falta leer")
+    assert asyncio.run(main._stream_llm_json(llm, [])) == TRICKY
+    assert llm.closed
+
+def test_stream_without_json_raises():
+    with pytest.raises(ValueError):
+        asyncio.run(main._stream_llm_json(_StreamLLM("No puedo resolver este problema."), []))
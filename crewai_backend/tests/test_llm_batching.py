@@ -0,0 +1,183 @@
+# crewai_backend/tests/test_llm_batching.py
+import asyncio
+import re
+
+import functools
+
+import orjson
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+_PROBLEM = re.compile(r"ENTREGAS: (.*)\n\s*VEHÍCULOS: (.*)")
+
+def _solve(deliveries, fleet):
+    """Todas las entregas al primer vehículo: basta para identificar el problema."""
+    return {
+        "optimizedRoutes": [{
+            "routeId": "RUTA-LLM",
+            "vehicleId": fleet[0]["id"],
+            "stops": deliveries,
+            "totalWeight": sum(delivery["weight"] for delivery in deliveries),
+        }],
+        "unassignedDeliveries": [],
+    }
+
+class _Message:
+    def __init__(self, content: str):
+        self.content = content
+
+class StubLLM:
+    """LLM falso con ainvoke (lotes) y astream (problema individual)."""
+
+    def __init__(self, batch_size_override=None, release: asyncio.Event = None, swap_results=False,
+                 stream_reply=None):
+        self.ainvoke_calls = 0
+        self.astream_calls = 0
+        self.batch_size_override = batch_size_override
+        self.release = release
+        self.swap_results = swap_results
+        # Respuesta fija para astream: texto, o una excepción a lanzar
+        self.stream_reply = stream_reply
+
+    @staticmethod
+    def _problems(messages):
+        return [
+            (orjson.loads(deliveries), orjson.loads(fleet))
+            for deliveries, fleet in _PROBLEM.findall(messages[-1][1])
+        ]
+
+    async def ainvoke(self, messages):
+        self.ainvoke_calls += 1
+        if self.release is not None:
+            await self.release.wait()
+        results = [_solve(*problem) for problem in self._problems(messages)]
+        if self.batch_size_override is not None:
+            results = results[:self.batch_size_override]
+        if self.swap_results:
+            results[0], results[1] = results[1], results[0]
+        return _Message(orjson.dumps(results).decode())
+
+    async def astream(self, messages):
+        self.astream_calls += 1
+        if isinstance(self.stream_reply, Exception):
+            raise self.stream_reply
+        text = self.stream_reply or orjson.dumps(_solve(*self._problems(messages)[0])).decode()
+        for index in range(0, len(text), 16):
+            yield _Message(text[index:index + 16])
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    main.llm_cache.clear()
+    yield
+    main.llm_cache.clear()
+
+def _problem(index: int):
+    return [{"id": f"d{index}", "weight": index + 1}], [{"id": f"v{index}", "capacity": 100}]
+
+def _use_llm(monkeypatch, llm):
+    """Sustituye get_llm conservando su interfaz de lru_cache."""
+    monkeypatch.setattr(main, "get_llm", functools.lru_cache(maxsize=1)(lambda: llm))
+
+def _run_with_batcher(llm, monkeypatch, scenario):
+    _use_llm(monkeypatch, llm)
+
+    async def run():
+        async with main.lifespan(main.app):
+            return await scenario()
+
+    return asyncio.run(run())
+
+def test_concurrent_requests_share_one_ainvoke(monkeypatch):
+    llm = StubLLM()
+
+    async def scenario():
+        return await asyncio.gather(*(main.optimize_with_llm(*_problem(i)) for i in range(5)))
+
+    results = _run_with_batcher(llm, monkeypatch, scenario)
+    assert llm.ainvoke_calls == 1
+    assert llm.astream_calls == 0
+    for index, result in enumerate(results):
+        assert not result.get("_internal_fallback")
+        assert result["optimizedRoutes"][0]["stops"] == _problem(index)[0]
+
+def test_wrong_length_reply_falls_back_per_problem(monkeypatch):
+    llm = StubLLM(batch_size_override=1)
+
+    async def scenario():
+        return await asyncio.gather(*(main.optimize_with_llm(*_problem(i)) for i in range(3)))
+
+    results = _run_with_batcher(llm, monkeypatch, scenario)
+    assert llm.ainvoke_calls == 1
+    assert llm.astream_calls == 3
+    for index, result in enumerate(results):
+        assert not result.get("_internal_fallback")
+        assert result["optimizedRoutes"][0]["stops"] == _problem(index)[0]
+
+def test_swapped_results_fall_back_per_problem(monkeypatch):
+    llm = StubLLM(swap_results=True)
+
+    async def scenario():
+        return await asyncio.gather(*(main.optimize_with_llm(*_problem(i)) for i in range(3)))
+
+    results = _run_with_batcher(llm, monkeypatch, scenario)
+    assert llm.ainvoke_calls == 1
+    assert llm.astream_calls == 3
+    for index, result in enumerate(results):
+        assert result["optimizedRoutes"][0]["stops"] == _problem(index)[0]
+        assert result["optimizedRoutes"][0]["vehicleId"] == _problem(index)[1][0]["id"]
+
+def test_cancelled_waiter_does_not_break_batch(monkeypatch):
+    async def scenario():
+        release = asyncio.Event()
+        llm = StubLLM(release=release)
+        _use_llm(monkeypatch, llm)
+        tasks = [asyncio.create_task(main.optimize_with_llm(*_problem(i))) for i in range(3)]
+        # Esperar a que el lote esté en vuelo antes de cancelar a uno
+        while llm.ainvoke_calls == 0:
+            await asyncio.sleep(0.005)
+        tasks[1].cancel()
+        release.set()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        return llm, results
+
+    llm, results = _run_with_batcher(None, monkeypatch, scenario)
+    assert llm.ainvoke_calls == 1
+    assert isinstance(results[1], asyncio.CancelledError)
+    for index in (0, 2):
+        assert results[index]["optimizedRoutes"][0]["stops"] == _problem(index)[0]
+
+def _post_twice(llm, monkeypatch):
+    monkeypatch.setattr(main, "CAN_USE_LLM", True)
+    _use_llm(monkeypatch, llm)
+    deliveries, fleet = _problem(0)
+    with TestClient(main.app) as client:
+        return [
+            client.post("/api/optimize-routes", json={"deliveries": deliveries, "fleet": fleet})
+            for _ in range(2)
+        ]
+
+def test_repeated_payload_is_served_from_cache(monkeypatch):
+    llm = StubLLM()
+    first, second = _post_twice(llm, monkeypatch)
+    assert first.headers["X-Cache"] == "MISS"
+    assert second.headers["X-Cache"] == "HIT"
+    assert llm.astream_calls == 1
+    assert first.json() == second.json()
+    assert second.json()["optimization_method"] == "llm_openai"
+
+@pytest.mark.parametrize("stream_reply", [
+    RuntimeError("LLM caído"),
+    "{}",
+    '{"optimizedRoutes": [{"vehicleId": "v0"}], "unassignedDeliveries": []}',
+])
+def test_fallbacks_and_malformed_results_are_not_cached(monkeypatch, stream_reply):
+    llm = StubLLM(stream_reply=stream_reply)
+    first, second = _post_twice(llm, monkeypatch)
+    assert llm.astream_calls == 2
+    for response in (first, second):
+        assert response.status_code == 200
+        assert response.headers["X-Cache"] == "MISS"
+        assert response.json()["optimization_method"] == "basic_algorithm_after_llm_error"
+    assert len(main.llm_cache) == 0
@@ -0,0 +1,142 @@
+# crewai_backend/tests/test_llm_sharding.py
+import asyncio
+import functools
+import re
+
+import orjson
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+_PROBLEM = re.compile(r"ENTREGAS: (.*)\n\s*VEHÍCULOS: (.*)")
+
+class _Message:
+    def __init__(self, content: str):
+        self.content = content
+
+class ShardStubLLM:
+    """
+    LLM falso que solo llena cada vehículo hasta la mitad, para que la
+    segunda pasada tenga trabajo. Alterna paradas como dict y como id.
+    Falla en los shards que contienen alguna entrega de `fail_ids`.
+    """
+
+    def __init__(self, fail_ids=()):
+        self.fail_ids = set(fail_ids)
+        self.prompts = []
+
+    async def astream(self, messages):
+        deliveries, fleet = (orjson.loads(part) for part in _PROBLEM.search(messages[-1][1]).groups())
+        self.prompts.append((deliveries, fleet))
+        if self.fail_ids & {delivery["id"] for delivery in deliveries}:
+            raise RuntimeError("shard caído")
+        remaining = {vehicle["id"]: vehicle["capacity"] / 2 for vehicle in fleet}
+        routes = {vehicle["id"]: [] for vehicle in fleet}
+        unassigned = []
+        for index, delivery in enumerate(deliveries):
+            for vehicle_id in routes:
+                if remaining[vehicle_id] >= delivery["weight"]:
+                    remaining[vehicle_id] -= delivery["weight"]
+                    routes[vehicle_id].append(delivery if index % 2 else delivery["id"])
+                    break
+            else:
+                unassigned.append(delivery["id"])
+        result = {
+            "optimizedRoutes": [
+                {"routeId": "RUTA-LLM", "vehicleId": vehicle_id, "stops": stops, "totalWeight": 0}
+                for vehicle_id, stops in routes.items() if stops
+            ],
+            "unassignedDeliveries": unassigned,
+        }
+        yield _Message(orjson.dumps(result).decode())
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    main.llm_cache.clear()
+    yield
+    main.llm_cache.clear()
+
+def _problem(deliveries: int, vehicles: int, capacity: float = 100):
+    return (
+        [{"id": f"d{i}", "weight": 1 + i % 7} for i in range(deliveries)],
+        [{"id": f"v{j}", "capacity": capacity} for j in range(vehicles)],
+    )
+
+def _check_solution(result, deliveries, fleet):
+    """Ninguna entrega duplicada ni perdida y ningún vehículo por encima de su capacidad."""
+    weights = {delivery["id"]: delivery["weight"] for delivery in deliveries}
+    capacities = {vehicle["id"]: vehicle["capacity"] for vehicle in fleet}
+    as_id = lambda item: item["id"] if isinstance(item, dict) else item
+
+    placed = []
+    for route in result["optimizedRoutes"]:
+        stop_ids = [as_id(stop) for stop in route["stops"]]
+        assert sum(weights[stop_id] for stop_id in stop_ids) <= capacities[route["vehicleId"]] + 1e-9
+        placed.extend(stop_ids)
+    placed.extend(as_id(item) for item in result["unassignedDeliveries"])
+    assert sorted(placed) == sorted(weights)
+    assert len({route["vehicleId"] for route in result["optimizedRoutes"]}) == len(result["optimizedRoutes"])
+
+@pytest.mark.parametrize("vehicles", [1, 2, 40])
+def test_shards_never_exceed_max_items(vehicles):
+    deliveries, fleet = _problem(1000, vehicles, capacity=10_000)
+    llm = ShardStubLLM()
+    result = asyncio.run(main.llm_optimize_routes_sharded(deliveries, fleet, llm))
+    assert len(llm.prompts) == 16
+    assert all(len(shard_deliveries) <= main.LLM_MAX_ITEMS_PER_SHARD for shard_deliveries, _ in llm.prompts)
+    # Con menos vehículos que shards la capacidad se reparte, no se multiplica
+    for vehicle in fleet:
+        shared = sum(
+            shard_vehicle["capacity"]
+            for _, shard_fleet in llm.prompts
+            for shard_vehicle in shard_fleet if shard_vehicle["id"] == vehicle["id"]
+        )
+        assert shared == pytest.approx(vehicle["capacity"])
+    _check_solution(result, deliveries, fleet)
+
+@pytest.mark.parametrize("deliveries_count, vehicles, capacity", [(200, 10, 60), (500, 3, 400), (300, 1, 2000)])
+def test_leftovers_fill_capacity_without_losing_deliveries(deliveries_count, vehicles, capacity):
+    deliveries, fleet = _problem(deliveries_count, vehicles, capacity)
+    result = asyncio.run(main.llm_optimize_routes_sharded(deliveries, fleet, ShardStubLLM()))
+    _check_solution(result, deliveries, fleet)
+    assert "_internal_fallback" not in result and "_partial_fallback" not in result
+    # Lo que el LLM dejó sin asignar lo coloca la segunda pasada si cabe
+    total_capacity = sum(vehicle["capacity"] for vehicle in fleet)
+    if sum(delivery["weight"] for delivery in deliveries) <= total_capacity / 2:
+        assert result["unassignedDeliveries"] == []
+
+def test_unknown_unassigned_ids_are_kept():
+    deliveries, fleet = _problem(3, 1)
+    result = {"optimizedRoutes": [], "unassignedDeliveries": ["d0", "fantasma"]}
+    main._assign_leftovers(result, deliveries, fleet, main._fleet_route_ids(fleet))
+    assert result["unassignedDeliveries"] == ["fantasma"]
+    assert result["optimizedRoutes"][0]["stops"] == [deliveries[0]]
+
+def test_basic_routes_use_request_fleet_index():
+    deliveries, fleet = _problem(200, 10, 60)
+    llm = ShardStubLLM(fail_ids={delivery["id"] for delivery in deliveries})
+    result = asyncio.run(main.llm_optimize_routes_sharded(deliveries, fleet, llm))
+    assert result["_internal_fallback"] is True
+    fleet_index = {vehicle["id"]: index for index, vehicle in enumerate(fleet)}
+    for route in result["optimizedRoutes"]:
+        assert route["routeId"] == f"RUTA-{route['vehicleId']}-{fleet_index[route['vehicleId']]}"
+    _check_solution(result, deliveries, fleet)
+
+def test_partial_fallback_is_reported_and_not_cached(monkeypatch):
+    deliveries, fleet = _problem(1000, 20, 500)
+    llm = ShardStubLLM(fail_ids={"d0"})
+    monkeypatch.setattr(main, "CAN_USE_LLM", True)
+    monkeypatch.setattr(main, "get_llm", functools.lru_cache(maxsize=1)(lambda: llm))
+    with TestClient(main.app) as client:
+        response = client.post("/api/optimize-routes", json={"deliveries": deliveries, "fleet": fleet})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["optimization_method"] == "llm_openai_partial"
+    assert body["llm_used"] is True
+    assert "1 de 16" in body["message"]
+    assert "_partial_fallback" not in body
+    assert len(main.llm_cache) == 0
+    # Las rutas del LLM conservan su routeId
+    assert any(route["routeId"] == "RUTA-LLM" for route in body["optimizedRoutes"])
+    _check_solution(body, deliveries, fleet)